@@ -1,7 +1,7 @@
 import sys
 
 from crossword import *
-from queue import Queue
+from collections import defaultdict, deque
 
 
 class CrosswordCreator():
@@ -11,8 +11,48 @@ class CrosswordCreator():
         Create new CSP crossword generate.
         """
         self.crossword = crossword
+
+        # Group the vocabulary by word length, so that each variable starts
+        # out with only the words that satisfy its unary constraint
+        words_by_len = defaultdict(set)
+        for word in self.crossword.words:
+            words_by_len[len(word)].add(word)
         self.domains = {
-            var: self.crossword.words.copy()
+            var: words_by_len[var.length].copy()
+            for var in self.crossword.variables
+        }
+
+        # Positions of each variable that overlap with some other variable,
+        # and a lazily built index of each domain by letter at those positions
+        self._positions = {var: set() for var in self.crossword.variables}
+        for (v1, v2), overlap in self.crossword.overlaps.items():
+            if overlap is not None:
+                self._positions[v1].add(overlap[0])
+        self._letter_index = dict()
+
+        # Neighbors of each variable and every arc in the problem, computed
+        # once since the structure of the puzzle never changes
+        self._neighbors = {
+            var: frozenset(self.crossword.neighbors(var))
+            for var in self.crossword.variables
+        }
+        self._arcs = [
+            (x, y)
+            for x in self.crossword.variables
+            for y in self._neighbors[x]
+        ]
+
+        # Open cells of the grid, which are the only ones ever drawn on
+        self._open_cells = [
+            (i, j)
+            for i in range(self.crossword.height)
+            for j in range(self.crossword.width)
+            if self.crossword.structure[i][j]
+        ]
+
+        # Number of neighbors of each variable, used to break MRV ties
+        self._degree = {
+            var: len(self._neighbors[var])
             for var in self.crossword.variables
         }
 
@@ -38,12 +78,11 @@ class CrosswordCreator():
         """
         letters = self.letter_grid(assignment)
         for i in range(self.crossword.height):
-            for j in range(self.crossword.width):
-                if self.crossword.structure[i][j]:
-                    print(letters[i][j] or " ", end="")
-                else:
-                    print("█", end="")
-            print()
+            print("".join(
+                (letters[i][j] or " ") if self.crossword.structure[i][j]
+                else "█"
+                for j in range(self.crossword.width)
+            ))
 
     def save(self, assignment, filename):
         """
@@ -65,24 +104,22 @@ class CrosswordCreator():
         font = ImageFont.truetype("assets/fonts/OpenSans-Regular.ttf", 80)
         draw = ImageDraw.Draw(img)
 
-        for i in range(self.crossword.height):
-            for j in range(self.crossword.width):
-
-                rect = [
-                    (j * cell_size + cell_border,
-                     i * cell_size + cell_border),
-                    ((j + 1) * cell_size - cell_border,
-                     (i + 1) * cell_size - cell_border)
-                ]
-                if self.crossword.structure[i][j]:
-                    draw.rectangle(rect, fill="white")
-                    if letters[i][j]:
-                        w, h = draw.textsize(letters[i][j], font=font)
-                        draw.text(
-                            (rect[0][0] + ((interior_size - w) / 2),
-                             rect[0][1] + ((interior_size - h) / 2) - 10),
-                            letters[i][j], fill="black", font=font
-                        )
+        # Blocked cells are left as the black background
+        for i, j in self._open_cells:
+            rect = [
+                (j * cell_size + cell_border,
+                 i * cell_size + cell_border),
+                ((j + 1) * cell_size - cell_border,
+                 (i + 1) * cell_size - cell_border)
+            ]
+            draw.rectangle(rect, fill="white")
+            if letters[i][j]:
+                w, h = draw.textsize(letters[i][j], font=font)
+                draw.text(
+                    (rect[0][0] + ((interior_size - w) / 2),
+                     rect[0][1] + ((interior_size - h) / 2) - 10),
+                    letters[i][j], fill="black", font=font
+                )
 
         img.save(filename)
 
@@ -100,14 +137,65 @@ class CrosswordCreator():
         (Remove any values that are inconsistent with a variable's unary
          constraints; in this case, the length of the word.)
         """
+        # Domains start out filtered by length in `__init__`; this pass is
+        # kept for callers who assign their own domains before solving
         for variable in self.domains:
-            vlength = variable.length
-            options = self.domains[variable].copy()
-            for word in self.domains[variable]:
-                if len(word) != vlength:
-                    options.discard(word)
-            self.domains[variable] = options
+            self.domains[variable] = {
+                word for word in self.domains[variable]
+                if len(word) == variable.length
+            }
 
+    def letter_index(self, var):
+        """
+        Return a mapping from each overlap position of `var` to a dict of
+        letter -> set of words in `self.domains[var]` with that letter at
+        that position. The index is rebuilt if `self.domains[var]` has been
+        replaced or has changed size since the index was built; on rebuild
+        the domain is copied, so that the set `remove_values` and
+        `restore_values` update in place belongs to the creator.
+        """
+        domain = self.domains[var]
+        cached = self._letter_index.get(var)
+        if cached is not None:
+            (indexed, size, index) = cached
+            if indexed is domain and size == len(domain):
+                return index
+        domain = self.domains[var] = set(domain)
+        index = {pos: dict() for pos in self._positions[var]}
+        for word in domain:
+            for pos, buckets in index.items():
+                buckets.setdefault(word[pos], set()).add(word)
+        self._letter_index[var] = (domain, len(domain), index)
+        return index
+
+    def remove_values(self, var, words):
+        """
+        Remove `words` from `self.domains[var]`, updating the letter index
+        of `var` in place rather than rebuilding it.
+        """
+        index = self.letter_index(var)
+        domain = self.domains[var]
+        domain -= words
+        for pos, buckets in index.items():
+            for word in words:
+                bucket = buckets[word[pos]]
+                bucket.discard(word)
+                if not bucket:
+                    del buckets[word[pos]]
+        self._letter_index[var] = (domain, len(domain), index)
+
+    def restore_values(self, var, words):
+        """
+        Add previously removed `words` back to `self.domains[var]`, updating
+        the letter index of `var` in place.
+        """
+        index = self.letter_index(var)
+        domain = self.domains[var]
+        domain |= words
+        for pos, buckets in index.items():
+            for word in words:
+                buckets.setdefault(word[pos], set()).add(word)
+        self._letter_index[var] = (domain, len(domain), index)
 
     def revise(self, x, y):
         """
@@ -118,19 +206,17 @@ class CrosswordCreator():
         Return True if a revision was made to the domain of `x`; return
         False if no revision was made.
         """
-        revised = False
-        xval = self.domains[x].copy()
         (i, j) = self.crossword.overlaps[x, y]
-        for xvalue in self.domains[x]:
-            counter = 0
-            for yvalue in self.domains[y]:
-                if xvalue[i] == yvalue[j]:
-                    counter += 1
-            if counter == 0:
-                xval.discard(xvalue)
-                revised = True
-        self.domains[x] = xval
-        return revised
+        buckets = self.letter_index(x)[i]
+
+        # Words sharing a letter at the overlap stand or fall together, so
+        # compare the letters present on each side and drop whole buckets
+        unsupported = buckets.keys() - self.letter_index(y)[j].keys()
+        if not unsupported:
+            return False
+        removed = set().union(*(buckets[letter] for letter in unsupported))
+        self.remove_values(x, removed)
+        return True
         
 
     def ac3(self, arcs=None):
@@ -143,16 +229,23 @@ class CrosswordCreator():
         return False if one or more domains end up empty.
         """
         if arcs is None:
-            arcs = Queue()
-            for value in self.domains:
-                for pair in self.crossword.neighbors(value):
-                    arcs.put((value, pair))
-        while not arcs.empty():
-            (v, p) = arcs.get()
-            result = self.revise(v, p)
-            if result:
-                for other in self.crossword.neighbors(v):
-                    arcs.put((other, v))
+            arcs = self._arcs
+        queue = deque()
+        queued = set()
+        for arc in arcs:
+            if arc not in queued:
+                queue.append(arc)
+                queued.add(arc)
+        while queue:
+            (v, p) = queue.popleft()
+            queued.discard((v, p))
+            if self.revise(v, p):
+                if not self.domains[v]:
+                    return False
+                for other in self._neighbors[v] - {p}:
+                    if (other, v) not in queued:
+                        queue.append((other, v))
+                        queued.add((other, v))
         for value in self.domains:
             if len(self.domains[value]) == 0:
                 return False
@@ -163,35 +256,72 @@ class CrosswordCreator():
         Return True if `assignment` is complete (i.e., assigns a value to each
         crossword variable); return False otherwise.
         """
-        for spot in self.domains:
-            try:
-                assignment[spot]
-            except KeyError:
-                return False
-        return True
+        return len(assignment) == len(self.domains)
 
     def consistent(self, assignment):
         """
         Return True if `assignment` is consistent (i.e., words fit in crossword
         puzzle without conflicting characters); return False otherwise.
         """
-        done = dict()
+        if len(set(assignment.values())) != len(assignment):
+            return False
         for word in assignment:
             if word.length != len(assignment[word]):
                 return False
-            try:
-                done[assignment[word]]
-                return False
-            except KeyError:
-                pass
-            temp = [x for x in self.domains if x not in assignment]
-            for layer in [x for x in self.crossword.neighbors(word) if x not in temp]:
+            for layer in self._neighbors[word]:
+                if layer not in assignment:
+                    continue
                 (i, j) = self.crossword.overlaps[word, layer]
                 if assignment[word][i] != assignment[layer][j]:
                     return False
-            done[assignment[word]] = word
         return True
 
+    def is_consistent_with(self, var, value, assignment, used_words):
+        """
+        Return True if assigning `value` to `var` keeps the already consistent
+        `assignment` consistent; return False otherwise. Only constraints
+        involving `var` are checked. `used_words` is the set of words already
+        in `assignment`.
+        """
+        if var.length != len(value):
+            return False
+        if value in used_words:
+            return False
+        for neighbor in self._neighbors[var]:
+            if neighbor in assignment:
+                (i, j) = self.crossword.overlaps[var, neighbor]
+                if value[i] != assignment[neighbor][j]:
+                    return False
+        return True
+
+    def forward_check(self, var, value, assignment):
+        """
+        Remove from the domain of each unassigned neighbor of `var` the words
+        that conflict with `value` at their overlap.
+
+        Return a list of (variable, removed words) pairs, in the order the
+        removals were made; return None if a neighbor would be left with no
+        values, in which case all domains are left unchanged.
+        """
+        removals = []
+        for neighbor in self._neighbors[var]:
+            if neighbor in assignment:
+                continue
+            (i, j) = self.crossword.overlaps[var, neighbor]
+            buckets = self.letter_index(neighbor)[j]
+            if value[i] not in buckets:
+                for other, words in reversed(removals):
+                    self.restore_values(other, words)
+                return None
+            removed = set().union(*(
+                words for letter, words in buckets.items()
+                if letter != value[i]
+            ))
+            if removed:
+                self.remove_values(neighbor, removed)
+                removals.append((neighbor, removed))
+        return removals
+
     def order_domain_values(self, var, assignment):
         """
         Return a list of values in the domain of `var`, in order by
@@ -199,19 +329,25 @@ class CrosswordCreator():
         The first value in the list, for example, should be the one
         that rules out the fewest values among the neighbors of `var`.
         """
+        # The neighbor buckets and domain sizes are the same for every value
+        # of `var`, so look them up once rather than once per sort key
+        constraints = []
+        for match in self._neighbors[var]:
+            (i, j) = self.crossword.overlaps[var, match]
+            constraints.append(
+                (i, self.letter_index(match)[j], len(self.domains[match]))
+            )
+
+        def ruled_out(word):
+            return sum(
+                size - len(buckets.get(word[i], ()))
+                for i, buckets, size in constraints
+            )
+
         ordered = list(self.domains[var])
-        ordered.sort(reverse=False, key=lambda x: self.sort(x, var))
+        ordered.sort(reverse=False, key=ruled_out)
         return ordered
 
-    def sort(self, word, var):    
-        num = 0
-        for match in self.crossword.neighbors(var):
-            (i, j) = self.crossword.overlaps[var, match]
-            for val in self.domains[match]:
-                if word[i] != val[j]:
-                    num += 1
-        return num
-
     def select_unassigned_variable(self, assignment):
         """
         Return an unassigned variable not already part of `assignment`.
@@ -220,41 +356,44 @@ class CrosswordCreator():
         degree. If there is a tie, any of the tied variables are acceptable
         return values.
         """
-        options = [x for x in list(self.domains.keys()) if x not in list(assignment.keys())]
+        options = [x for x in self.domains if x not in assignment]
         if len(options) == 0:
             return None
-        min = options[0]
-        minval = len(self.domains[min])
-        for option in options[1:]:
-            comp = len(self.domains[option])
-            if comp == minval:
-                if self.crossword.neighbors(option) > self.crossword.neighbors(min):
-                    min = option
-                    minval = comp
-            elif comp < minval:
-                min = option
-                minval = comp
-        return min
-
-    def backtrack(self, assignment):
+        return min(
+            options,
+            key=lambda x: (len(self.domains[x]), -self._degree[x])
+        )
+
+    def backtrack(self, assignment, used_words=None):
         """
         Using Backtracking Search, take as input a partial assignment for the
         crossword and return a complete assignment if possible to do so.
 
         `assignment` is a mapping from variables (keys) to words (values).
+        `used_words` is the set of words in `assignment`, kept in step with
+        it across recursive calls.
 
         If no assignment is possible, return None.
         """
+        if used_words is None:
+            used_words = set(assignment.values())
         if self.assignment_complete(assignment):
             return assignment
         var = self.select_unassigned_variable(assignment)
         for value in self.order_domain_values(var, assignment):
-            assignment[var] = value
-            if self.consistent(assignment):
-                result = self.backtrack(assignment)
-                if self.consistent(result):
+            if self.is_consistent_with(var, value, assignment, used_words):
+                removals = self.forward_check(var, value, assignment)
+                if removals is None:
+                    continue
+                assignment[var] = value
+                used_words.add(value)
+                result = self.backtrack(assignment, used_words)
+                if result is not None:
                     return result
-            assignment.pop(var)
+                assignment.pop(var)
+                used_words.discard(value)
+                for neighbor, words in reversed(removals):
+                    self.restore_values(neighbor, words)
         return None
         
 